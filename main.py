@@ -3,7 +3,9 @@ from src.database.db_control import DatabaseControl
 from src.transform.transform import Transform
 from dotenv import load_dotenv
 import os
+import queue
 import threading
+import time
 import argparse
 import logging
 
@@ -15,8 +17,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def setup_database():
-    """Initialize database and create necessary structures."""
+def setup_database(max_connections: int = 8, bootstrap: bool = True):
+    """Initialize database access and, unless told otherwise, create necessary structures."""
 
     load_dotenv()
 
@@ -27,24 +29,82 @@ def setup_database():
         "dbname": os.getenv("DB_NAME")
     }
 
-    db_control = DatabaseControl(db_params)
+    db_control = DatabaseControl(db_params, max_connections)
+
+    if bootstrap:
+        db_control.bootstrap()
 
     return db_control
 
-def generate_and_store_profiles(db_control: DatabaseControl, generator: ProfileGenerator, num_profiles: int):
-    """Generate profiles and store them in database."""
-    for (profile, delay) in generator.generate_profiles(num_profiles):
-        inserted_profile = db_control.insert_profile(profile)
+def store_batches(db_control: DatabaseControl, profiles: queue.Queue, batch_size: int, max_wait: float = 0.05):
+    """Writer thread - collect profiles from the queue into batches and insert them until it gets None.
+
+    A batch is flushed once it has batch_size profiles or max_wait seconds passed since its first profile,
+    so slow generation doesn't keep already generated profiles waiting for a full batch."""
+    stopped = False
+
+    while not stopped:
+        item = profiles.get()
+        if item is None:
+            break
+
+        batch = [item]
+        deadline = time.monotonic() + max_wait
 
-        if inserted_profile:
-            # Gets last entry from db, but isn't used for generation of json files
-            # Because, why sync saving json files with this? We may be getting entries from somewhere else too.
-            # We need to listen for entries.
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
 
-            latest_json = db_control.get_latest_profile()
-            logger.info(f"Profile generated with delay: {delay:.2f}s")
+            try:
+                item = profiles.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            if item is None:
+                stopped = True
+                break
+            batch.append(item)
+
+        inserted = db_control.insert_profiles([profile for profile, _ in batch])
+
+        if inserted:
+            # JSON files aren't generated from here - the listener thread gets every profile's JSON through
+            # NOTIFY anyway (we may be getting entries from somewhere else too), so no need to read it back.
+            logger.info(f"Batch of {inserted} profiles generated with total delay: "
+                        f"{sum(delay for _, delay in batch):.2f}s")
         else:
-            logger.error("Failed to insert profile")
+            logger.error("Failed to insert profile batch")
+
+def generate_and_store_profiles(db_control: DatabaseControl, generator: ProfileGenerator, num_profiles: int,
+                                batch_size: int = 1000, workers: int = 4, delay_range=(1, 5), processes: int = 1):
+    """Generate profiles and store them in database in batches of up to batch_size.
+
+    Profiles are generated with random delays from delay_range between them (None for no delays), or without
+    delays in `processes` worker processes when that's more than 1.
+    Generation runs here while `workers` writer threads batch and insert the profiles, so generator delays and
+    database round-trips overlap. The queue is bounded so generation can't run too far ahead of the writers."""
+    profiles = queue.Queue(maxsize=max(1000, batch_size * workers))
+
+    writers = [threading.Thread(target=store_batches, args=(db_control, profiles, batch_size))
+               for _ in range(workers)]
+    for writer in writers:
+        writer.start()
+
+    if processes > 1:
+        generated = generator.generate_profiles_parallel(num_profiles, processes)
+    else:
+        generated = generator.generate_profiles(num_profiles, delay_range)
+
+    try:
+        for item in generated:
+            profiles.put(item)
+    finally:
+        # One stop signal per writer, then wait for the remaining profiles to be stored
+        for _ in writers:
+            profiles.put(None)
+        for writer in writers:
+            writer.join()
 
 def main():
 
@@ -56,34 +116,93 @@ def main():
         default=10,
         help='Number of profiles to generate (default: 10)'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Maximum number of profiles inserted per database transaction (default: 1000)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of threads inserting batches into the database (default: 4)'
+    )
+    parser.add_argument(
+        '--no-delay',
+        action='store_true',
+        help='Generate profiles without the random 1-5s delays between them (for bulk loading)'
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of processes generating profiles, requires --no-delay (default: 1)'
+    )
+    parser.add_argument(
+        '--jsonl',
+        action='store_true',
+        help='Append JSON profiles to results/profiles.jsonl instead of writing a file per profile'
+    )
+    parser.add_argument(
+        '--skip-setup',
+        action='store_true',
+        help='Skip creating the database, tables and procedures - use when they already exist'
+    )
     args = parser.parse_args()
 
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.processes > 1 and not args.no_delay:
+        parser.error("--processes can only be used together with --no-delay")
+
+    db_control = None
+    transform_json = None
     try:
         logger.info("Starting profile generation process...")
 
         # Initialize components
-        db_control = setup_database()
+        # Every writer thread holds one pooled connection at a time
+        db_control = setup_database(max_connections=args.workers, bootstrap=not args.skip_setup)
 
         # Initialize transformation
         transform_json = Transform()
 
         # Setup for listening and beginning of listening for notifications from DB
+        save_profiles = transform_json.save_jsonl if args.jsonl else transform_json.save_json_files
         listener_thread = threading.Thread(target=db_control.start_listening,
-                                           args=(transform_json.save_json_to_file,), # This function is the callback of start_listening - so it receives json files.
+                                           args=(save_profiles,), # This function is the callback of start_listening - so it receives batches of json files.
                                            daemon=True)
         listener_thread.start()
 
+        # Profiles inserted before LISTEN is active would never get their JSON written
+        while not db_control.listening.wait(timeout=0.1):
+            if not listener_thread.is_alive():
+                raise RuntimeError("Listener failed to start")
+
         # Setup od generator
         generator = ProfileGenerator()
 
         # Generate and store profiles
-        generate_and_store_profiles(db_control, generator, args.num_profiles)
+        generate_and_store_profiles(db_control, generator, args.num_profiles, args.batch_size, args.workers,
+                                    delay_range=None if args.no_delay else (1, 5), processes=args.processes)
+
+        # All profiles are in - wait for the listener to write the JSON of the last ones before exiting
+        db_control.stop_listening()
+        listener_thread.join()
 
         logger.info("Profile generation completed successfully")
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
         raise
+    finally:
+        # After the listener is done, so every JSON it handed over is written before exiting
+        if transform_json:
+            transform_json.close()
+        if db_control:
+            db_control.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,30 @@
 from faker import Faker
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
 import random
-import uuid
 import time
+import os
+
+# Generator of the current worker process, see ProfileGenerator.generate_profiles_parallel
+_worker_generator = None
+
+def _init_worker():
+    """Create the worker process' own generator, so Faker's locale data is loaded once per process."""
+    global _worker_generator
+    _worker_generator = ProfileGenerator()
+
+    # Forked workers inherit the parent's random state - reseed so they don't all generate the same profiles
+    random.seed()
+    _worker_generator.fake.seed_instance()
+
+def _generate_chunk(count):
+    """Generate count profiles in a worker process."""
+    return [profile for profile, _ in _worker_generator.generate_profiles(count)]
 
 class ProfileGenerator:
+    # How many profiles' worth of random choices are drawn at once, see _draw_choices
+    CHOICES_CHUNK_SIZE = 1000
+
     def __init__(self):
 
         # pip install Faker
@@ -18,33 +39,34 @@ class ProfileGenerator:
         self.communication_methods = ["email", "push", "sms"]
         self.sizes = ["XS", "S", "M", "L", "XL", "XXL"]
 
+        # Populations for _draw_choices, built once here instead of for every chunk
+        # Category is picked uniformly and then subcategory uniformly within it - weighting each
+        # (category, subcategory) pair by 1 / number of subcategories keeps exactly that distribution
+        self._category_pairs = [(cat, subcat) for cat, subcats in self.categories.items() for subcat in subcats]
+        self._category_cum_weights = list(accumulate(1 / len(self.categories[cat]) for cat, _ in self._category_pairs))
+        self._genders = ['male', 'female']
+        self._male_shoe_sizes = list(range(40, 48))
+        self._female_shoe_sizes = list(range(34, 42))
+        self._consents = [True, False]
+
+        # Customer IDs handed out by this generator, so it never repeats one
+        self._issued_ids = set()
+
     def generate_profile(self):
         """Generate a single customer profile with all required fields."""
+        return self._build_profile(next(self._draw_choices(1)))
+
+    def _build_profile(self, choices):
+        """Build a profile from one row of pre-generated values (see _draw_choices)."""
+        (first_name, last_name, birth_date, home_address, home_city, postal_code, phone_number, join_date,
+         gender, favourite_color, (favourite_category, favourite_sub_category), shirt_size, pants_size, shoe_size,
+         marketing_consent, communication_method, loyalty_points) = choices
 
-        # Personal information
-        first_name = self.fake.first_name()
-        last_name = self.fake.last_name()
-        gender = random.choice(['male', 'female'])
-        birth_date = self.fake.date_of_birth(minimum_age=18, maximum_age=70).strftime('%Y-%m-%d')
-
-        # Contact information
-        home_address = self.fake.street_address()
-        home_city = self.fake.city()
-        postal_code = self.fake.postcode()
-        phone_number = self.fake.phone_number()
-
-        # Preferences
-        favourite_color = random.choice(self.colours)
-        favourite_category, favourite_sub_category = self._get_favourite_category()
-        shirt_size, pants_size, shoe_size = self._get_sizes(gender)
-        marketing_consent = random.choice([True, False])
-        communication_method = random.choice(self.communication_methods)
+        birth_date = birth_date.strftime('%Y-%m-%d')
 
         # System data & company related info
-        join_date = self.fake.date_between(start_date='-10y', end_date='today')
-        customer_id = str(uuid.uuid4().int)[:9]
+        customer_id = self._new_customer_id()
         loyalty_id = int(f"2201{customer_id}")  # 2201 prefix because that's my birthday and customer ID
-        loyalty_points = random.randint(0, 1000000)
         date_joined = join_date.strftime('%Y-%m-%d')
         test_profile = True
         # datetime.now().strftime('%Y-%m-%d %H:%M:%S') # Commented out because I implemented it in SQLite
@@ -86,37 +108,98 @@ class ProfileGenerator:
             }
         }
 
-    def generate_profiles(self, count=1, delay_range=(1, 5)):
-        """Generate multiple profiles with random delays between generations."""
+    def _new_customer_id(self):
+        """Random 9 digit customer ID, not issued by this generator before."""
+        while True:
+            number = random.randrange(10**9)
+            # Collisions get likely after some tens of thousands of profiles, so they're worth checking
+            if number not in self._issued_ids:
+                self._issued_ids.add(number)
+                return f"{number:09d}"
 
-        delay_gen = 0
-
-        for _ in range(count):
-            time.sleep(delay_gen)
-            profile_gen = self.generate_profile()
-            delay_gen = random.uniform(*delay_range)
-            yield profile_gen, delay_gen
-
-    def _get_favourite_category(self):
-        """For generation of random categories and subcategories from a list of dictionaries."""
+    def generate_profiles(self, count=1, delay_range=None):
+        """Generate multiple profiles, with random delays between generations if delay_range (min, max) is given.
 
-        cat = random.choice(list(self.categories.keys()))
-        subcat = random.choice(self.categories[cat])
+        Without delay_range profiles are generated as fast as possible and the yielded delay is always 0."""
 
-        return cat, subcat
-
-    def _get_sizes(self, gender):
-        """For generation of according sizes with regard to gender"""
-
-        shirt_size = random.choice(self.sizes)
-        pants_size = random.choice(self.sizes)
+        delay_gen = 0
 
-        if gender=="male":
-            shoe_size = random.choice(range(40, 48))
-        else:
-            shoe_size = random.choice(range(34, 42))
+        for choices in self._draw_choices(count):
+            if delay_range is not None:
+                time.sleep(delay_gen)
+            profile_gen = self._build_profile(choices)
+            if delay_range is not None:
+                delay_gen = random.uniform(*delay_range)
+            yield profile_gen, delay_gen
 
-        return shirt_size, pants_size, shoe_size
+    def generate_profiles_parallel(self, count=1, workers=None):
+        """Generate profiles in `workers` processes (default: CPU count), without delays.
+
+        Yields (profile, 0) like generate_profiles does, in chunks as the worker processes finish them."""
+
+        workers = workers or os.cpu_count() or 1
+
+        # Enough chunks for every worker to get a few of them, but not so small that sending them around dominates
+        chunk_size = max(1, min(self.CHOICES_CHUNK_SIZE, -(-count // (workers * 4))))
+        chunks = [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            for profiles in executor.map(_generate_chunk, chunks):
+                for profile in profiles:
+                    yield profile, 0
+
+    def _draw_choices(self, count):
+        """Yield one tuple of Faker values and random choices per profile, for count profiles.
+
+        Values are generated for up to CHOICES_CHUNK_SIZE profiles at a time - choices with random.choices(k=...),
+        which is a lot cheaper than separate random.choice calls per field and profile, and Faker values in
+        tight loops over provider methods looked up once, instead of going through the Faker proxy every time."""
+
+        first_name = self.fake.first_name
+        last_name = self.fake.last_name
+        date_of_birth = self.fake.date_of_birth
+        street_address = self.fake.street_address
+        city = self.fake.city
+        postcode = self.fake.postcode
+        phone_number = self.fake.phone_number
+        date_between = self.fake.date_between
+
+        for start in range(0, count, self.CHOICES_CHUNK_SIZE):
+            k = min(self.CHOICES_CHUNK_SIZE, count - start)
+            rows = range(k)
+
+            genders = random.choices(self._genders, k=k)
+            male_shoe_sizes = random.choices(self._male_shoe_sizes, k=k)
+            female_shoe_sizes = random.choices(self._female_shoe_sizes, k=k)
+
+            # Sizes with regard to gender
+            shoe_sizes = [male if gender == "male" else female
+                          for gender, male, female in zip(genders, male_shoe_sizes, female_shoe_sizes)]
+
+            yield from zip(
+                # Personal information
+                [first_name() for _ in rows],
+                [last_name() for _ in rows],
+                [date_of_birth(minimum_age=18, maximum_age=70) for _ in rows],
+
+                # Contact information
+                [street_address() for _ in rows],
+                [city() for _ in rows],
+                [postcode() for _ in rows],
+                [phone_number() for _ in rows],
+                [date_between(start_date='-10y', end_date='today') for _ in rows],
+
+                # Preferences and loyalty points
+                genders,
+                random.choices(self.colours, k=k),
+                random.choices(self._category_pairs, cum_weights=self._category_cum_weights, k=k),
+                random.choices(self.sizes, k=k),
+                random.choices(self.sizes, k=k),
+                shoe_sizes,
+                random.choices(self._consents, k=k),
+                random.choices(self.communication_methods, k=k),
+                random.choices(range(1000001), k=k)
+            )
 
 # Example usage of "Profile Generator" segment of the task
 if __name__ == "__main__":
@@ -1,49 +1,125 @@
-from datetime import datetime
-import json
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import logging
 import os
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class Transform:
 
-    def __init__(self, output_dir: str = "results"):
+    def __init__(self, output_dir: str = "results", write_workers: int = 4):
         """Object for saving json. Call save_json_to_file after this to save.
 
         Args:
-            output_dir: Dictionary containing the profile data"""
+            output_dir: Dictionary containing the profile data
+            write_workers: Number of threads writing the files of save_json_files"""
 
         self.output_dir = output_dir
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        # save_json_files only queues the files here, so the caller (the listener) doesn't wait on the disk.
+        # Call close() once nothing is saving anymore to wait for the queued files.
+        self._writers = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix="json-writer")
+
+        # Everything in a file path but the customer ID and timestamp, joined once instead of for every file
+        self._path_prefix = os.path.join(output_dir, "profile_")
+
+        # (second, formatted timestamp) - see _timestamp
+        self._ts_cache = (None, None)
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
             logger.info(f"Created output directory: {output_dir}")
 
-    def save_json_to_file(self, profile_data: dict):
+    def save_json_files(self, profiles: list):
+        """
+        Save a batch of profiles, one JSON file each, sharing one timestamp.
+        Files are written in the background by the writer threads, so this returns right away.
+        A file that fails to save is logged and doesn't stop the rest of the batch.
+
+        Args:
+            profiles: List of dictionaries containing the profile data
+        """
+        timestamp = self._timestamp()
+
+        for profile_data in profiles:
+            # Errors are already logged by save_json_to_file, nobody needs the future's result
+            self._writers.submit(self.save_json_to_file, profile_data, timestamp)
+
+    def close(self):
+        """Wait until all files queued by save_json_files are written. Saving files after this fails."""
+        self._writers.shutdown(wait=True)
+
+    def save_json_to_file(self, profile_data: dict, timestamp: str = None):
         """
         Save profile data to JSON file.
 
         Args:
             profile_data: Dictionary containing the profile data
+            timestamp: Timestamp for the file name, current time if not given
         """
         try:
             # Extract customer ID from the nested structure
             customer_id = profile_data.get('identification', {}).get('customerId', 'unknown')
 
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-            filename = f"profile_{customer_id}_{timestamp}.json"
+            if timestamp is None:
+                timestamp = self._timestamp()
 
             # Create full file path
-            file_path = os.path.join(self.output_dir, filename)
+            file_path = f"{self._path_prefix}{customer_id}_{timestamp}.json"
+
+            # Save JSON with proper formatting. orjson serializes straight to UTF-8 bytes in C,
+            # way faster than json.dump's pure Python pretty-printer
+            data = orjson.dumps(profile_data, option=orjson.OPT_INDENT_2)
 
-            # Save JSON with proper formatting
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(profile_data, f, indent=2, ensure_ascii=False)
+            # The whole file is already one bytes object, so write it through the raw fd
+            # and skip Python's buffered file layer
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                written = 0
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+            finally:
+                os.close(fd)
 
             logger.info(f"Profile saved to: {file_path}")
 
         except Exception as e:
             logger.error(f"Error saving profile to file: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def save_jsonl(self, profiles: list, path: str = None):
+        """
+        Append a batch of profiles to a single JSON Lines file, one compact JSON profile per line.
+        Way cheaper than a file per profile for big runs - one open and one write per batch.
+
+        Args:
+            profiles: List of dictionaries containing the profile data
+            path: File to append to, profiles.jsonl in the output directory if not given
+        """
+        if path is None:
+            path = os.path.join(self.output_dir, "profiles.jsonl")
+
+        try:
+            data = b"".join([orjson.dumps(profile_data) + b"\n" for profile_data in profiles])
+
+            with open(path, "ab") as f:
+                f.write(data)
+
+            logger.info(f"{len(profiles)} profiles appended to: {path}")
+
+        except Exception as e:
+            logger.error(f"Error appending profiles to {path}: {e}")
+            raise
+
+    def _timestamp(self) -> str:
+        """Timestamp used in file names, only re-formatted when the second changes."""
+        second = int(time.time())
+        cached_second, timestamp = self._ts_cache
+
+        if second != cached_second:
+            timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(second))
+            self._ts_cache = (second, timestamp)
+
+        return timestamp